@@ -1,28 +1,45 @@
 import os
+import argparse
+import hashlib
+import importlib.util
 import json
 import re
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 from tqdm import tqdm  # 导入tqdm库用于进度条显示
 import unicodedata  # 用于处理Unicode字符规范化
-import tiktoken
 from collections import Counter
+from functools import lru_cache
+import rules_db
 
 VALID_ZONE_RE = re.compile(r"^(?:\d?AU[A-Za-z0-9]?|[UAN][A-Za-z0-9]?)$", re.IGNORECASE)
 
-try:
-    import openai
-    openai_available = True
-    # 设置OpenAI API密钥（请替换为你自己的密钥）
-    openai.api_key = ""
-except ImportError:
+# 只检查 openai 是否已安装，真正的导入延迟到第一次调用 API 时（见 get_openai）
+openai_available = importlib.util.find_spec("openai") is not None
+if not openai_available:
     print("警告: 未找到openai模块，将使用正则表达式方法")
-    openai_available = False
 
 # —— 模型 & 最大输入 tokens（留 ~20% 生成空间） ——
 MODEL = "gpt-4o-mini"
 MAX_INPUT_TOKENS = 13000
-enc = tiktoken.encoding_for_model(MODEL)
+
+
+@lru_cache(maxsize=None)
+def get_encoder():
+    """延迟加载 tiktoken 编码器：只有真正需要切分文本时才导入并构建"""
+    import tiktoken
+    return tiktoken.encoding_for_model(MODEL)
+
+
+@lru_cache(maxsize=None)
+def get_openai():
+    """延迟导入 openai 模块并设置 API 密钥"""
+    import openai
+    # 设置OpenAI API密钥（请替换为你自己的密钥）
+    openai.api_key = ""
+    return openai
 
 
 def find_zone_section(obj, zone_code):
@@ -42,6 +59,7 @@ def find_zone_section(obj, zone_code):
     return None
 
 def split_into_chunks(text: str) -> list[str]:
+    enc = get_encoder()
     token_ids = enc.encode(text)
     return [enc.decode(token_ids[i:i+MAX_INPUT_TOKENS])
             for i in range(0, len(token_ids), MAX_INPUT_TOKENS)]
@@ -93,7 +111,7 @@ Notes:
 - Pour l'emprise au sol, chercher: "emprise au sol", "coefficient d'emprise", "CES", etc.
 - Pour le retrait, chercher: "recul", "retrait", "distance minimale", "marge de recul", etc.
 """
-            response = openai.ChatCompletion.create(
+            response = get_openai().ChatCompletion.create(
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": "Vous êtes un assistant spécialisé dans l'extraction d'informations à partir de documents d'urbanisme français. Vous devez extraire précisément les valeurs demandées sans ajouter d'informations supplémentaires."},
@@ -295,193 +313,505 @@ def extract_insee(text, filename, json_obj=None):
         return m.group(1)
     return ""
 
-def process_json_files():
-    folder_path = input("请输入包含 JSON 文件的文件夹路径: ").strip()
-    if folder_path and not folder_path.endswith(os.sep):
-        folder_path += os.sep
-    if not os.path.isdir(folder_path):
-        raise FileNotFoundError(f"指定的文件夹不存在: {folder_path}")
-
-    output_json_path = input("请输入输出 JSON 文件的路径（例如 output.json）: ").strip()
-    if not output_json_path.lower().endswith(".json"):
-        output_json_path += ".json"
-
-    json_files = [f for f in os.listdir(folder_path) if f.lower().endswith(".json")]
-    print(f"共找到 {len(json_files)} 个JSON文件待处理")
-
-    # 读取 libzone.json，获取所有允许的代号
+def extract_all_zone_codes(text: str, libzone_list: set) -> list[str]:
+    matches = re.findall(r"Zone\s*([A-Za-z0-9]+)", text, re.IGNORECASE)
+    valid = [m.upper() for m in matches if VALID_ZONE_RE.match(m)]
+    filtered = [z for z in valid if z in libzone_list]
+    return sorted(set(filtered))
+
+class ApiBudget:
+    """线程安全的 LLM 调用额度，多个工作线程共享同一个上限"""
+
+    def __init__(self, limit, used=0):
+        self.limit = limit
+        self.used = used
+        self._lock = threading.Lock()
+
+    def available(self):
+        with self._lock:
+            return self.used < self.limit
+
+    def acquire(self):
+        """占用一次调用额度；额度用完时返回 False"""
+        with self._lock:
+            if self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+def process_file(folder_path, filename, libzone_list, api_budget, update_date, default_source="Local Urban Plan"):
+    """
+    处理单个 JSON 文件，返回一条进度记录（即 JSONL 中的一行）：
+      {"source_file", "insee", "status": "success" | "incomplete" | "failed",
+       "reason", "missing_insee", "api_calls", "libzone_recognized", "records": [...]}
+    api_budget 为共享的 ApiBudget，每次 LLM 调用前占用一次额度。
+    任何意外异常都会变成一条 "failed" 记录（已发生的 API 调用次数仍保留），保证该文件会被写入进度文件。
+    """
+    entry = {
+        "source_file": filename,
+        "insee": "",
+        "status": "failed",
+        "reason": "",
+        "missing_insee": False,
+        "api_calls": 0,
+        "libzone_recognized": False,
+        "records": [],
+    }
     try:
-        with open("libell/libzone.json", "r", encoding="utf-8") as f:
-            libzone_data = json.load(f)
-        libzone_list = set(libzone_data.get("libelle", []))
+        return _process_file(entry, folder_path, filename, libzone_list, api_budget, update_date, default_source)
     except Exception as e:
-        print(f"加载 libzone.json 出错: {e}")
-        libzone_list = set()
+        entry["status"] = "failed"
+        entry["reason"] = f"处理出错: {type(e).__name__}: {e}"
+        entry["records"] = []
+        return entry
+
+def _process_file(entry, folder_path, filename, libzone_list, api_budget, update_date, default_source):
+    """process_file 的实际处理逻辑，结果直接写入 entry"""
+    file_path = os.path.join(folder_path, filename)
+    try:
+        with open(file_path, encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        entry["reason"] = f"JSON解析错误: {e}"
+        return entry
 
-    results = {}
-    missing_insee_count = 0
-    success_logs = []
-    failure_logs = []
-    api_usage_count = 0
-    max_api_calls = 50
+    raw_text = extract_text(data)
+    if not raw_text:
+        entry["reason"] = "未找到任何文本内容"
+        return entry
 
-    recognized_libzone_count = 0
+    cleaned_text = normalize_french_text(raw_text)
+    matches = re.findall(r"Zone\s*([A-Za-z0-9]+)", cleaned_text, re.IGNORECASE)
+    valid = [z.upper() for z in matches if VALID_ZONE_RE.match(z) and len(z)>=2]
+    filtered = [z for z in valid if z in libzone_list]
+    #print(f"[DEBUG] {filename} 有效候选: {valid}")
+    #print(f"[DEBUG] {filename} 最终过滤: {filtered}")
 
-    update_date = datetime.now().strftime("%Y-%m-%d")
-    default_source = "Local Urban Plan"
+    zone_code = Counter(filtered).most_common(1)[0][0] if filtered else None
 
-    for filename in tqdm(json_files, desc="处理进度", unit="文件"):
-        file_path = os.path.join(folder_path, filename)
-        try:
-            data = json.load(open(file_path, encoding="utf-8"))
-        except Exception as e:
-            failure_logs.append((filename, f"JSON解析错误: {e}"))
-            continue
+    # 使用改进后的 extract_zone 函数：先用正则，如果不行则调用 LLM
+    insee = extract_insee(cleaned_text, filename, data)
 
-        raw_text = extract_text(data)
-        if not raw_text:
-            failure_logs.append((filename, "未找到任何文本内容"))
-            continue
+    if not insee:
+        entry["missing_insee"] = True
+        entry["reason"] = "未提取到 INSEE"
+        return entry
+    entry["insee"] = insee
 
-        cleaned_text = normalize_french_text(raw_text)
-        matches = re.findall(r"Zone\s*([A-Za-z0-9]+)", cleaned_text, re.IGNORECASE)
-        valid = [z.upper() for z in matches if VALID_ZONE_RE.match(z) and len(z)>=2]
-        filtered = [z for z in valid if z in libzone_list]
-        #print(f"[DEBUG] {filename} 有效候选: {valid}")
-        #print(f"[DEBUG] {filename} 最终过滤: {filtered}")
-
-       
-        zone_code = Counter(filtered).most_common(1)[0][0] if filtered else None
-       
-       
-        def extract_all_zone_codes(text: str, libzone_list: set) -> list[str]:
-            matches = re.findall(r"Zone\s*([A-Za-z0-9]+)", text, re.IGNORECASE)
-            valid = [m.upper() for m in matches if VALID_ZONE_RE.match(m)]
-            filtered = [z for z in valid if z in libzone_list]
-            return sorted(set(filtered))
-        # 使用改进后的 extract_zone 函数：先用正则，如果不行则调用 LLM
-        insee = extract_insee(cleaned_text, filename, data)
-
-        if not insee:
-            missing_insee_count += 1
-            failure_logs.append((filename, "未提取到 INSEE"))
-            continue
+    regex_results = extract_with_regex(cleaned_text.lower())
+    max_height = regex_results.get("max_height")
+    max_coverage = regex_results.get("max_coverage")
+    setback_distance = regex_results.get("setback_distance")
 
-        regex_results = extract_with_regex(cleaned_text.lower())
-        max_height = regex_results.get("max_height")
-        max_coverage = regex_results.get("max_coverage")
-        setback_distance = regex_results.get("setback_distance")
-
-        zone_codes = extract_all_zone_codes(cleaned_text, libzone_list)
-        libzone_extracted = zone_code  
-      
-        zone_codes = data.get("typezone", [])
-
-        for zone_code in zone_codes:
-            libzone = zone_code
-           # typezone = zone_code  # typezone 就等于 zone_code
-
-            # 直接取 JSON 中同名 key 下的规则
-            zone_rules = data.get(zone_code, {})
-
-            output_obj = {
-                "zone": zone_code,
-                "libzone": libzone,
-                #"typezone": typezone,
-                "insee": insee,
-                "rules": {
-                    "max_height": zone_rules.get("max_height", ""),
-                    "max_coverage": zone_rules.get("max_coverage", ""),
-                    "setback_distance": zone_rules.get("setback_distance", ""),
-                },
-                "update_date": update_date,
-                "source": default_source,
-                "source_file": filename,
-            }
-            results.setdefault(insee, []).append(output_obj)
-        
-       
-
-        missing_fields = any(not val for val in [max_height, max_coverage, setback_distance])
-        if openai_available and api_usage_count < max_api_calls and missing_fields:
-            chunks = split_into_chunks(cleaned_text)
-            llm_results = {"max_height": None, "max_coverage": None, "setback_distance": None}
-            for chunk in chunks:
-                part = extract_with_openai_retry(chunk)
-                api_usage_count += 1
-                if part and isinstance(part, dict):
-                    for key in llm_results:
-                        if not llm_results[key] and part.get(key):
-                            llm_results[key] = part[key]
-                if all(llm_results.values()):
-                    break
+    zone_codes = extract_all_zone_codes(cleaned_text, libzone_list)
+    libzone_extracted = zone_code
 
-            if not max_height and llm_results.get("max_height"):
-                max_height = llm_results["max_height"]
-            if not max_coverage and llm_results.get("max_coverage"):
-                max_coverage = llm_results["max_coverage"]
-            if not setback_distance and llm_results.get("setback_distance"):
-                setback_distance = llm_results["setback_distance"]
+    zone_codes = data.get("typezone", [])
 
-        max_height = max_height or ""
-        max_coverage = max_coverage or ""
-        setback_distance = setback_distance or ""
+    for zone_code in zone_codes:
+        libzone = zone_code
+       # typezone = zone_code  # typezone 就等于 zone_code
 
-        if libzone_extracted:
-            recognized_libzone_count += 1
+        # 直接取 JSON 中同名 key 下的规则
+        zone_rules = data.get(zone_code, {})
 
         output_obj = {
             "zone": zone_code,
-            "libzone": libzone_extracted,
-           # "typezone": typezone,
+            "libzone": libzone,
+            #"typezone": typezone,
             "insee": insee,
             "rules": {
-                "max_height": max_height,
-                "max_coverage": max_coverage,
-                "setback_distance": setback_distance,
+                "max_height": zone_rules.get("max_height", ""),
+                "max_coverage": zone_rules.get("max_coverage", ""),
+                "setback_distance": zone_rules.get("setback_distance", ""),
             },
             "update_date": update_date,
             "source": default_source,
             "source_file": filename,
         }
-        results.setdefault(insee, []).append(output_obj)
+        entry["records"].append(output_obj)
+
+    missing_fields = any(not val for val in [max_height, max_coverage, setback_distance])
+    if openai_available and api_budget.available() and missing_fields:
+        chunks = split_into_chunks(cleaned_text)
+        llm_results = {"max_height": None, "max_coverage": None, "setback_distance": None}
+        for chunk in chunks:
+            if not api_budget.acquire():
+                break
+            part = extract_with_openai_retry(chunk)
+            entry["api_calls"] += 1
+            if part and isinstance(part, dict):
+                for key in llm_results:
+                    if not llm_results[key] and part.get(key):
+                        llm_results[key] = part[key]
+            if all(llm_results.values()):
+                break
+
+        if not max_height and llm_results.get("max_height"):
+            max_height = llm_results["max_height"]
+        if not max_coverage and llm_results.get("max_coverage"):
+            max_coverage = llm_results["max_coverage"]
+        if not setback_distance and llm_results.get("setback_distance"):
+            setback_distance = llm_results["setback_distance"]
+
+    max_height = max_height or ""
+    max_coverage = max_coverage or ""
+    setback_distance = setback_distance or ""
+
+    if libzone_extracted:
+        entry["libzone_recognized"] = True
+
+    output_obj = {
+        "zone": zone_code,
+        "libzone": libzone_extracted,
+       # "typezone": typezone,
+        "insee": insee,
+        "rules": {
+            "max_height": max_height,
+            "max_coverage": max_coverage,
+            "setback_distance": setback_distance,
+        },
+        "update_date": update_date,
+        "source": default_source,
+        "source_file": filename,
+    }
+    entry["records"].append(output_obj)
+
+    if max_height and max_coverage and setback_distance:
+        entry["status"] = "success"
+    else:
+        missing_list = []
+        if not max_height:
+            missing_list.append("max_height")
+        if not max_coverage:
+            missing_list.append("max_coverage")
+        if not setback_distance:
+            missing_list.append("setback_distance")
+        entry["status"] = "incomplete"
+        entry["reason"] = f"缺少字段: {', '.join(missing_list)}"
+    return entry
+
+def journal_path_for(output_json_path):
+    """流式输出文件（JSON Lines）路径：与最终 JSON 同名，扩展名为 .jsonl"""
+    return os.path.splitext(output_json_path)[0] + ".jsonl"
+
+def _read_journal(journal_path):
+    """
+    逐行读取 JSONL 进度文件，产出 (偏移量, 原始行, 记录)；遇到中断时写了一半的末尾行即停止，
+    不修改文件本身。
+    """
+    pos = 0
+    with open(journal_path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            yield pos, line, entry
+            pos += len(line)
 
-        if max_height and max_coverage and setback_distance:
-            success_logs.append(filename)
+def load_journal(journal_path):
+    """
+    读取已有的 JSONL 进度文件，返回 {source_file: 最后一条进度记录（不含 records）}，用于断点续跑。
+    如果最后一行因中断而写了一半，则将文件截断到最后一条完整记录。
+    """
+    done = {}
+    if not os.path.exists(journal_path):
+        return done
+    valid_end = 0
+    for pos, line, entry in _read_journal(journal_path):
+        entry.pop("records", None)
+        # 同一文件重试过时保留最后一条记录，API 调用次数累计
+        previous = done.get(entry["source_file"])
+        if previous:
+            entry["api_calls"] += previous["api_calls"]
+        done[entry["source_file"]] = entry
+        valid_end = pos + len(line)
+    if valid_end < os.path.getsize(journal_path):
+        print(f"进度文件末尾记录不完整，已截断: {journal_path}")
+        with open(journal_path, "r+b") as f:
+            f.truncate(valid_end)
+    return done
+
+def append_journal(f, entry):
+    """追加一条进度记录并立即刷新，进程中断时已写入的记录不会丢失"""
+    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    f.flush()
+
+def _iter_journal_results(journal_path, offsets):
+    """按 INSEE 依次读取（seek）对应的行，逐个产出 (insee, records)，内存只保留一个 INSEE 的记录"""
+    with open(journal_path, "rb") as f:
+        for insee, positions in offsets.items():
+            records = []
+            for pos in positions:
+                f.seek(pos)
+                records.extend(json.loads(f.readline())["records"])
+            yield insee, records
+
+def compact_journal(journal_path, output_json_path, total_files, update_date, source_files=None):
+    """
+    将 JSONL 进度文件压缩为原有的 {"metadata", "results"} JSON 格式，并生成 SQLite 数据库。
+    先扫描进度文件，记录每个 INSEE 所在行的偏移量并统计元数据，再按 INSEE 流式写出。
+    提供 source_files 时，不在其中的文件（例如已从输入文件夹删除）的记录会被忽略。
+    """
+    offsets = {}
+    metadata = {
+        "total_files": total_files,
+        "success_files": 0,
+        "incomplete_files": 0,
+        "missing_insee": 0,
+        "api_calls": 0,
+        "recognized_libzone_count": 0,
+        "processed_date": update_date,
+    }
+    # 同一文件可能有多条记录（失败后重试）：只保留最后一条，但 API 调用次数按所有记录累计
+    latest = {}
+    for pos, _, entry in _read_journal(journal_path):
+        if source_files is None or entry["source_file"] in source_files:
+            latest[entry["source_file"]] = pos
+            metadata["api_calls"] += entry["api_calls"]
+    for pos, _, entry in _read_journal(journal_path):
+        if latest.get(entry["source_file"]) != pos:
+            continue
+        if entry["status"] == "success":
+            metadata["success_files"] += 1
         else:
-            missing_list = []
-            if not max_height:
-                missing_list.append("max_height")
-            if not max_coverage:
-                missing_list.append("max_coverage")
-            if not setback_distance:
-                missing_list.append("setback_distance")
-            failure_logs.append((filename, f"缺少字段: {', '.join(missing_list)}"))
-
-    with open(output_json_path, "w", encoding="utf-8") as f:
-        json.dump({
-            "metadata": {
-                "total_files": len(json_files),
-                "success_files": len(success_logs),
-                "incomplete_files": len(failure_logs),
-                "missing_insee": missing_insee_count,
-                "api_calls": api_usage_count,
-                "recognized_libzone_count": recognized_libzone_count,
-                "processed_date": update_date,
-            },
-            "results": results,
-        }, f, ensure_ascii=False, indent=2)
+            metadata["incomplete_files"] += 1
+        metadata["missing_insee"] += int(entry["missing_insee"])
+        metadata["recognized_libzone_count"] += int(entry["libzone_recognized"])
+        if entry["records"]:
+            offsets.setdefault(entry["insee"], []).append(pos)
+
+    # 输出与 json.dump(..., indent=2) 相同的格式
+    tmp_path = output_json_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        header = json.dumps({"metadata": metadata}, ensure_ascii=False, indent=2)
+        f.write(header[:-2] + ",\n  \"results\": {")
+        first = True
+        for insee, records in _iter_journal_results(journal_path, offsets):
+            body = json.dumps(records, ensure_ascii=False, indent=2).replace("\n", "\n    ")
+            f.write(("\n" if first else ",\n") + f"    {json.dumps(insee)}: {body}")
+            first = False
+        f.write("}\n}" if first else "\n  }\n}")
+    os.replace(tmp_path, output_json_path)
+
+    output_db_path = os.path.splitext(output_json_path)[0] + ".db"
+    rules_db.write_rules_db(_iter_journal_results(journal_path, offsets), output_db_path, metadata)
+    return metadata, output_db_path
+
+def shard_of(filename, shard_count):
+    """按文件名的哈希值分片；使用 md5 而不是 hash()，保证不同机器上结果一致"""
+    return int(hashlib.md5(filename.encode("utf-8")).hexdigest(), 16) % shard_count
+
+def checkpoint_path_for(output_json_path):
+    return os.path.splitext(output_json_path)[0] + ".checkpoint.json"
+
+def write_checkpoint(journal, output_json_path, state):
+    """将进度文件落盘（fsync），并写出检查点状态文件；续跑时用它确认运行参数未改变"""
+    if journal is not None:
+        journal.flush()
+        os.fsync(journal.fileno())
+    checkpoint_path = checkpoint_path_for(output_json_path)
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(dict(state, updated_at=datetime.now().isoformat(timespec="seconds")), f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, checkpoint_path)
+
+# 续跑时必须与检查点一致的运行参数
+CHECKPOINT_KEYS = ("input_dir", "libzone", "shard_index", "shard_count")
+
+def check_resume(output_json_path, state):
+    """已有检查点时，确认输入文件夹、libzone 文件和分片参数未改变，否则拒绝续跑"""
+    checkpoint_path = checkpoint_path_for(output_json_path)
+    if not os.path.exists(checkpoint_path):
+        return
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        previous = json.load(f)
+    changed = [f"{key}: {previous.get(key)!r} -> {state[key]!r}"
+               for key in CHECKPOINT_KEYS if previous.get(key) != state[key]]
+    if changed:
+        raise ValueError(f"运行参数与检查点 {checkpoint_path} 不一致（{'; '.join(changed)}），"
+                         f"请使用 --restart 重新开始，或换一个 --output")
+
+def merge_journals(journal_paths, output_json_path):
+    """
+    合并各分片的 JSONL 进度文件，并压缩为一个最终的 JSON / SQLite 输出。
+    同一 source_file 出现多次时只保留最后一条；输入文件只读，末尾不完整的行直接跳过。
+    """
+    journal_path = journal_path_for(output_json_path)
+    for path in journal_paths:
+        if os.path.abspath(path) == os.path.abspath(journal_path):
+            raise ValueError(f"合并输入不能与输出进度文件相同: {path}")
+    latest = {}
+    for index, path in enumerate(journal_paths):
+        for pos, _, entry in _read_journal(path):
+            latest[entry["source_file"]] = (index, pos)
+    keep = set(latest.values())
+    with open(journal_path, "wb") as out:
+        for index, path in enumerate(journal_paths):
+            for pos, line, _ in _read_journal(path):
+                if (index, pos) in keep:
+                    out.write(line)
+    update_date = datetime.now().strftime("%Y-%m-%d")
+    return compact_journal(journal_path, output_json_path, len(latest), update_date)
+
+def process_json_files(folder_path=None, output_json_path=None, libzone_path="libell/libzone.json",
+                       workers=1, max_api_calls=50, shard_index=0, shard_count=1, checkpoint_every=20,
+                       restart=False):
+    """
+    处理文件夹中的所有 JSON 文件。未提供 folder_path / output_json_path 时通过 input() 询问。
+    shard_count > 1 时只处理 shard_of(文件名) == shard_index 的文件，便于在多台机器上切分语料；
+    每处理 checkpoint_every 个文件写一次检查点，被中断的任务重新运行即可从进度文件续跑。
+    restart=True 时丢弃已有进度文件，重新提取所有文件（例如语料或 libzone.json 有变化时）。
+    """
+    if folder_path is None:
+        folder_path = input("请输入包含 JSON 文件的文件夹路径: ").strip()
+    if folder_path and not folder_path.endswith(os.sep):
+        folder_path += os.sep
+    if not os.path.isdir(folder_path):
+        raise FileNotFoundError(f"指定的文件夹不存在: {folder_path}")
 
-    print(f"处理完成！结果已保存至: {output_json_path}")
-    print(f"成功解析的文件数: {len(success_logs)}")
-    print(f"未完全解析的文件数: {len(failure_logs)}")
-    print(f"未提取到 INSEE 的文件数: {missing_insee_count}")
+    if output_json_path is None:
+        output_json_path = input("请输入输出 JSON 文件的路径（例如 output.json）: ").strip()
+    if not output_json_path.lower().endswith(".json"):
+        output_json_path += ".json"
+
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"分片编号无效: {shard_index}（分片总数 {shard_count}）")
+
+    json_files = sorted(f for f in os.listdir(folder_path) if f.lower().endswith(".json"))
+    if shard_count > 1:
+        json_files = [f for f in json_files if shard_of(f, shard_count) == shard_index]
+        print(f"分片 {shard_index}/{shard_count}：共找到 {len(json_files)} 个JSON文件待处理")
+    else:
+        print(f"共找到 {len(json_files)} 个JSON文件待处理")
+
+    # 读取 libzone.json，获取所有允许的代号
+    try:
+        with open(libzone_path, "r", encoding="utf-8") as f:
+            libzone_data = json.load(f)
+        libzone_list = set(libzone_data.get("libelle", []))
+    except Exception as e:
+        print(f"加载 libzone.json 出错: {e}")
+        libzone_list = set()
+
+    update_date = datetime.now().strftime("%Y-%m-%d")
+    default_source = "Local Urban Plan"
+
+    # 每个文件处理完立即追加到 JSONL；已存在的进度文件会被续跑，已处理的文件直接跳过
+    journal_path = journal_path_for(output_json_path)
+    state = {
+        "input_dir": os.path.abspath(folder_path),
+        "libzone": os.path.abspath(libzone_path),
+        "shard_index": shard_index,
+        "shard_count": shard_count,
+    }
+    if restart:
+        for path in (journal_path, checkpoint_path_for(output_json_path)):
+            if os.path.exists(path):
+                print(f"重新开始：删除 {path}")
+                os.remove(path)
+    else:
+        check_resume(output_json_path, state)
+    # 只保留当前输入文件的进度，已从输入中删除的文件不参与续跑和压缩
+    current_files = set(json_files)
+    journaled = {name: entry for name, entry in load_journal(journal_path).items() if name in current_files}
+    api_budget = ApiBudget(max_api_calls, used=sum(entry["api_calls"] for entry in journaled.values()))
+    # 只跳过 success / incomplete 的文件；failed（可能是暂时性错误）在续跑时重新处理
+    done = {name for name, entry in journaled.items() if entry["status"] != "failed"}
+    pending = [f for f in json_files if f not in done]
+    if journaled:
+        retried = len(journaled) - len(done)
+        print(f"从进度文件 {journal_path} 续跑：已处理 {len(done)} 个文件，"
+              f"重试失败的 {retried} 个，剩余 {len(pending)} 个")
+
+    state.update(
+        total_files=len(json_files),
+        processed_files=len(json_files) - len(pending),
+        api_calls=api_budget.used,
+    )
+
+    def run(filename):
+        return process_file(folder_path, filename, libzone_list, api_budget, update_date, default_source)
+
+    # 只有主线程写进度文件；同时在途的任务数受限，内存不随语料规模增长
+    with open(journal_path, "a", encoding="utf-8") as journal, \
+            ThreadPoolExecutor(max_workers=max(1, workers)) as executor, \
+            tqdm(total=len(pending), desc="处理进度", unit="文件") as progress:
+        # 开始处理前先记录运行参数，之后续跑时可据此校验
+        write_checkpoint(journal, output_json_path, state)
+        queue = iter(pending)
+        in_flight = set()
+        while True:
+            while len(in_flight) < max(1, workers) * 2:
+                filename = next(queue, None)
+                if filename is None:
+                    break
+                in_flight.add(executor.submit(run, filename))
+            if not in_flight:
+                break
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                append_journal(journal, future.result())
+                state["processed_files"] += 1
+                progress.update(1)
+                if checkpoint_every and state["processed_files"] % checkpoint_every == 0:
+                    write_checkpoint(journal, output_json_path, dict(state, api_calls=api_budget.used))
+        write_checkpoint(journal, output_json_path, dict(state, api_calls=api_budget.used))
+
+    metadata, output_db_path = compact_journal(journal_path, output_json_path, len(json_files), update_date,
+                                               source_files=current_files)
+
+    print(f"处理完成！结果已保存至: {output_json_path}（数据库: {output_db_path}，进度文件: {journal_path}）")
+    print(f"成功解析的文件数: {metadata['success_files']}")
+    print(f"未完全解析的文件数: {metadata['incomplete_files']}")
+    print(f"未提取到 INSEE 的文件数: {metadata['missing_insee']}")
     if openai_available:
-        print(f"API调用次数: {api_usage_count}")
-    print(f"成功识别到 libzone 的文件数: {recognized_libzone_count}")
+        print(f"API调用次数: {metadata['api_calls']}")
+    print(f"成功识别到 libzone 的文件数: {metadata['recognized_libzone_count']}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="从 PLU 规章 JSON 文件中批量提取区域规则（可断点续跑、可分片）")
+    parser.add_argument("--input-dir", help="包含 JSON 文件的文件夹；不提供时交互询问")
+    parser.add_argument("--output", help="输出 JSON 文件路径（同时生成 .jsonl 进度文件和 .db 数据库）；不提供时交互询问")
+    parser.add_argument("--libzone", default="libell/libzone.json", help="libzone.json 路径")
+    parser.add_argument("--workers", type=int, default=1, help="并行处理的线程数")
+    parser.add_argument("--max-api-calls", type=int, default=50, help="LLM 调用次数上限（续跑时累计计算）")
+    parser.add_argument("--shard-index", type=int, default=0, help="当前分片编号（从 0 开始）")
+    parser.add_argument("--shard-count", type=int, default=1, help="分片总数，按文件名哈希切分语料")
+    parser.add_argument("--checkpoint-every", type=int, default=20, help="每处理多少个文件写一次检查点")
+    parser.add_argument("--restart", action="store_true",
+                        help="丢弃已有的 .jsonl 进度文件，重新提取所有文件（语料或 libzone.json 变化后使用）")
+    parser.add_argument("--merge", nargs="+", metavar="JSONL",
+                        help="不处理文件，只将各分片的 .jsonl 进度文件合并压缩到 --output")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.merge:
+        if not args.output:
+            raise ValueError("--merge 需要同时指定 --output")
+        output_json_path = args.output if args.output.lower().endswith(".json") else args.output + ".json"
+        metadata, output_db_path = merge_journals(args.merge, output_json_path)
+        print(f"已合并 {len(args.merge)} 个进度文件（共 {metadata['total_files']} 个文件）至: {output_json_path}（数据库: {output_db_path}）")
+        return
+    process_json_files(
+        folder_path=args.input_dir,
+        output_json_path=args.output,
+        libzone_path=args.libzone,
+        workers=args.workers,
+        max_api_calls=args.max_api_calls,
+        shard_index=args.shard_index,
+        shard_count=args.shard_count,
+        checkpoint_every=args.checkpoint_every,
+        restart=args.restart,
+    )
 
 if __name__ == "__main__":
     try:
-        process_json_files()
+        main()
     except Exception as e:
         print(f"程序执行出错: {e}")
+        raise SystemExit(1)
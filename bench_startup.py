@@ -0,0 +1,64 @@
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Mesure du temps d'import à froid des modules de l'application, chacun dans un interpréteur neuf.
+# Utilisation : python bench_startup.py [-n répétitions] [--ref <commit>]
+# Avec --ref, le même module est aussi mesuré dans un git worktree du commit de référence,
+# pour comparer avant / après.
+MODULES = ["main", "matcher", "REGLEMENT"]
+HEAVY_MODULES = ["pandas", "geopandas", "tiktoken", "openai"]
+
+def import_time(module: str, cwd: str) -> tuple:
+    code = (
+        "import time, sys\n"
+        "t = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(time.perf_counter() - t)\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules) or '-')\n"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=cwd)
+    lines = out.stdout.strip().splitlines()
+    return float(lines[-2]), lines[-1]
+
+def measure(module: str, cwd: str, repeat: int) -> str:
+    # main.py monte static/ et output/ à l'import : ces dossiers doivent exister
+    os.makedirs(os.path.join(cwd, "output"), exist_ok=True)
+    try:
+        runs = [import_time(module, cwd) for _ in range(repeat)]
+    except subprocess.CalledProcessError as e:
+        return f"import impossible : {e.stderr.strip().splitlines()[-1]}"
+    times = [t for t, _ in runs]
+    return (f"médiane {statistics.median(times) * 1000:8.1f} ms | min {min(times) * 1000:8.1f} ms | "
+            f"modules lourds chargés : {runs[-1][1]}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Temps d'import à froid des modules de l'application")
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="nombre de répétitions par module")
+    parser.add_argument("--ref", help="commit de référence à mesurer dans un git worktree (ex. e170111)")
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    worktree = None
+    if args.ref:
+        worktree = tempfile.mkdtemp(prefix="bench_ref_")
+        subprocess.run(["git", "worktree", "add", "--detach", worktree, args.ref],
+                       cwd=here, check=True, capture_output=True)
+    try:
+        for module in MODULES:
+            if worktree:
+                print(f"{module:<10} {args.ref:<8} {measure(module, worktree, args.repeat)}")
+                print(f"{module:<10} {'actuel':<8} {measure(module, here, args.repeat)}")
+            else:
+                print(f"{module:<10} {measure(module, here, args.repeat)}")
+    finally:
+        if worktree:
+            subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=here, capture_output=True)
+            shutil.rmtree(worktree, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,25 @@ from fastapi.responses import HTMLResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi import BackgroundTasks
+import gc
 import os, uvicorn
 import downloader
 import matcher
-import geopandas as gpd
 
 app = FastAPI()
 
+# PLU_PRELOAD=1 : charger les règles dès l'import, dans le processus maître, afin que les workers
+# forkés (par ex. gunicorn --preload -k uvicorn.workers.UvicornWorker) partagent ces pages en
+# copy-on-write. gc.freeze() évite que le ramasse-miettes ne les touche et ne les duplique.
+if os.environ.get("PLU_PRELOAD") == "1":
+    matcher.warm_up()
+    gc.freeze()
+
+@app.on_event("startup")
+async def warm_up():
+    # Sans préchargement, chaque worker charge les règles une fois au démarrage plutôt qu'à la première requête
+    matcher.warm_up()
+
 # Monter le répertoire des fichiers statiques (utilisé pour map.js et le fichier GeoJSON de sortie)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.mount("/output", StaticFiles(directory="output"), name="output")
@@ -47,7 +59,8 @@ async def process_insee(request: Request, insee: str = Form(...)):
     if not os.path.exists(zonage_path):
         raise HTTPException(status_code=404, detail=f"Le fichier zonage.shp n'a pas été trouvé dans les données pour le code INSEE {insee}.")
     
-    # Charger zonage.shp
+    # Charger zonage.shp (geopandas est importé à la demande pour accélérer le démarrage)
+    import geopandas as gpd
     try:
         gdf = gpd.read_file(zonage_path)
     except Exception as e:
@@ -55,6 +68,8 @@ async def process_insee(request: Request, insee: str = Form(...)):
     
     # Appeler le module matcher, pour associer les règles au GeoDataFrame
     gdf_matched = matcher.match_zoning(gdf, insee)
+    match_stats = gdf_matched.attrs.get("match_stats", {})
+    print(f"Appariement {insee} : {match_stats}")
     gdf_matched = gdf_matched.to_crs(epsg=4326)
     
     # Enregistrer le résultat en GeoJSON dans le dossier output
@@ -71,7 +86,8 @@ async def process_insee(request: Request, insee: str = Form(...)):
         "request": request,
         "insee": insee,
         "geojson_path": f"/output/{insee}.geojson",
-        "rules": rules_details
+        "rules": rules_details,
+        "match_stats": match_stats
     })
 
 if __name__ == "__main__":
@@ -1,66 +1,202 @@
 import json
 import os
-import pandas as pd
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+import rules_db
+from zone_codes import normalize_zone_code, zone_family
 
 RULES_FILE = "rules.json"
+# Base compacte produite par REGLEMENT.py (ou rules_db.py) ; utilisée si elle n'est pas plus ancienne que rules.json
+RULES_DB = rules_db.RULES_DB
+
+# Cache des règles chargées : (chemin, mtime) -> DataFrame. Rempli par warm_up() avant le fork
+# des workers pour être partagé en copy-on-write, puis rechargé seulement si rules.json change.
+_rules_cache = {}
+# Couples (mtime de rules.db, mtime de rules.json) déjà signalés comme obsolètes
+_stale_db_warned = set()
+
+# Seuil de similarité (SequenceMatcher) pour accepter une correspondance approximative
+FUZZY_THRESHOLD = 0.8
+# Nombre de candidats n-grammes évalués par la distance d'édition
+FUZZY_CANDIDATES = 5
+# Longueur maximale d'un suffixe de secteur ("1", "2", "a", "h1"...) : deux codes qui ne diffèrent
+# que par un tel suffixe final désignent des secteurs distincts et ne sont jamais appariés par approximation
+SECTOR_SUFFIX_LEN = 2
+
+EMPTY_RULE = {"max_height": "", "max_coverage": "", "setback_distance": ""}
+
+def _is_sibling_sector(code: str, key: str) -> bool:
+    """Vrai si code et key ne diffèrent que par leur suffixe final de secteur (ex. 1AUH1 / 1AUH2, 1AUH / 1AUH2)."""
+    common = 0
+    while common < min(len(code), len(key)) and code[common] == key[common]:
+        common += 1
+    return common > 0 and max(len(code), len(key)) - common <= SECTOR_SUFFIX_LEN
+
+def _ngrams(code: str, n: int = 2) -> set:
+    padded = f"^{code}$"
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+class ZoneIndex:
+    """
+    Index de correspondance entre les libellés de zone (LIBELLE du zonage) et les codes
+    présents dans rules.json. La recherche se fait dans l'ordre : égalité des formes
+    canoniques, plus long code canonique préfixe du libellé, puis recherche approximative
+    (candidats par bigrammes, départagés par distance d'édition, au-delà strict du seuil). Les
+    correspondances par préfixe ou approximatives restent dans la même famille de zone
+    (U / AU / A / N), et un secteur voisin (1AUH1 / 1AUH2) n'est jamais retenu par approximation.
+    """
+
+    def __init__(self, rule_map: dict):
+        # rule_map : code brut -> dictionnaire de règles (le premier code canonique l'emporte)
+        self.rules = {}
+        for code, rule in rule_map.items():
+            key = normalize_zone_code(code)
+            if key and key not in self.rules:
+                self.rules[key] = rule
+        self._grams = defaultdict(set)
+        for key in self.rules:
+            family = zone_family(key)
+            for gram in _ngrams(key):
+                self._grams[family, gram].add(key)
+
+    def lookup(self, label):
+        """Retourner (code canonique, méthode) pour un libellé, ou ("", "unmatched")."""
+        code = normalize_zone_code(label)
+        if not code:
+            return "", "unmatched"
+        if code in self.rules:
+            return code, "exact"
+        family = zone_family(code)
+        for end in range(len(code) - 1, 0, -1):
+            if code[:end] in self.rules and zone_family(code[:end]) == family:
+                return code[:end], "prefix"
+        key = self._fuzzy(code, family)
+        if key:
+            return key, "fuzzy"
+        return "", "unmatched"
+
+    def _fuzzy(self, code: str, family: str):
+        counts = Counter()
+        for gram in _ngrams(code):
+            counts.update(self._grams.get((family, gram), ()))
+        best_key, best_score = "", FUZZY_THRESHOLD
+        for key, _ in counts.most_common(FUZZY_CANDIDATES):
+            # Un secteur voisin a sa propre réglementation : mieux vaut "unmatched" que ses règles
+            if _is_sibling_sector(code, key):
+                continue
+            score = SequenceMatcher(None, code, key).ratio()
+            if score > best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def match_many(self, labels) -> dict:
+        """Apparier une série de libellés ; chaque valeur distincte n'est traitée qu'une fois."""
+        return {label: self.lookup(label) for label in set(labels)}
 
 def load_rules():
+    mtime = os.path.getmtime(RULES_FILE)
+    key = (RULES_FILE, mtime)
+    if key in _rules_cache:
+        return _rules_cache[key]
+    # pandas n'est importé qu'au premier chargement des règles, pas au démarrage de l'application
+    import pandas as pd
     with open(RULES_FILE, "r", encoding="utf-8") as f:
         data = json.load(f)
     # Fusionner toutes les listes de règles associées aux codes INSEE dans un grand tableau
     all_rules = [record for rules in data["results"].values() for record in rules]
     df = pd.DataFrame(all_rules)
+    _rules_cache.clear()
+    _rules_cache[key] = df
     return df
 
-def get_rules_for_insee(insee_code: str):
+def _use_rules_db() -> bool:
+    """
+    rules.db n'est utilisée que si elle existe et n'est pas plus ancienne que rules.json ;
+    sinon rules.json a été remplacé ou régénéré depuis, et on retombe dessus avec un avertissement.
     """
-    Retourner tous les enregistrements dans rules.json dont le source_file commence par insee_code, pour l'affichage sur le frontend.
+    if not os.path.exists(RULES_DB):
+        return False
+    if os.path.exists(RULES_FILE) and os.path.getmtime(RULES_DB) < os.path.getmtime(RULES_FILE):
+        versions = (os.path.getmtime(RULES_DB), os.path.getmtime(RULES_FILE))
+        if versions not in _stale_db_warned:
+            _stale_db_warned.add(versions)
+            print(f"Avertissement : {RULES_DB} est plus ancienne que {RULES_FILE}, utilisation de {RULES_FILE}. "
+                  f"Régénérez la base avec : python rules_db.py {RULES_FILE} {RULES_DB}")
+        return False
+    return True
+
+def load_rules_for_insee(insee_code: str) -> list:
     """
+    Retourner les enregistrements d'une commune. Avec rules.db, seules les lignes de la commune
+    sont lues (mémoire et temps constants) ; sinon on retombe sur rules.json chargé en entier.
+    """
+    if _use_rules_db():
+        return rules_db.fetch_insee(insee_code, RULES_DB)
     df = load_rules()
-    df_insee = df[df["source_file"].str.startswith(insee_code)]
-    # Si besoin de simplifier les données des règles, cela peut être fait ici, par exemple :
-    # df_insee["max_height"] = df_insee["rules"].apply(lambda r: r.get("max_height", ""))
-    # df_insee["max_coverage"] = df_insee["rules"].apply(lambda r: r.get("max_coverage", ""))
-    # df_insee["setback_distance"] = df_insee["rules"].apply(lambda r: r.get("setback_distance", ""))
-    return df_insee.to_dict(orient="records")
+    return df[df["source_file"].str.startswith(insee_code)].to_dict(orient="records")
+
+def warm_up():
+    """
+    Précharger les règles (et pandas) une seule fois. Appelé au démarrage de chaque worker,
+    ou dans le processus maître avant le fork (gunicorn --preload) pour partager la mémoire.
+    Avec rules.db à jour, rien n'est préchargé : la base est lue à la demande via mmap.
+    """
+    if not _use_rules_db() and os.path.exists(RULES_FILE):
+        load_rules()
+
+def get_rules_for_insee(insee_code: str):
+    """
+    Retourner tous les enregistrements de la commune insee_code (rules.db ou rules.json), pour l'affichage sur le frontend.
+    """
+    return load_rules_for_insee(insee_code)
 
 def match_zoning(gdf, insee_code: str):
     """
     Basé sur le champ "IDZONE" dans gdf (chargé depuis zonage.shp), comparer avec les enregistrements de rules.json dont le nom commence par insee_code, et assigner les règles correspondantes à chaque zone.
     """
-    df_rules = load_rules()
-    df_insee = df_rules[df_rules["source_file"].str.startswith(insee_code)]
-    
+    records = load_rules_for_insee(insee_code)
+
     # Construire une correspondance : zone_code -> dictionnaire de règles (prendre le premier enregistrement)
     rule_map = {}
-    for _, row in df_insee.iterrows():
-        zone_code = row["libzone"].strip().upper()
-        if zone_code not in rule_map:
-            # Note : ici, row["rules"] est un dictionnaire, utilisez directement .get pour accéder aux champs internes
-            rule_map[zone_code] = {
-                "max_height": row["rules"].get("max_height") if isinstance(row["rules"], dict) else "",
-                "max_coverage": row["rules"].get("max_coverage") if isinstance(row["rules"], dict) else "",
-                "setback_distance": row["rules"].get("setback_distance") if isinstance(row["rules"], dict) else ""
-            }
-    
-    def assign_rule(row):
-        zone_type = row.get("LIBELLE", "").strip().upper()
-        # 先尝试精确匹配
-        if zone_type in rule_map:
-            selected_rule = rule_map[zone_type]
-        else:
-            # 模糊匹配：在 rule_map 的键中查找以 zone_type 开头的候选项
-            candidates = [key for key in rule_map.keys() if zone_type.startswith(key)]
-            if candidates:
-                # 选择匹配字符数最长的键
-                best_key = max(candidates, key=len)
-                selected_rule = rule_map[best_key]
-            else:
-                selected_rule = {"max_height": "", "max_coverage": "", "setback_distance": ""}
-        row["max_height"] = selected_rule["max_height"]
-        row["max_coverage"] = selected_rule["max_coverage"]
-        row["setback_distance"] = selected_rule["setback_distance"]
-        return row
-
-    gdf = gdf.apply(assign_rule, axis=1)
+    for row in records:
+        zone_code = row["libzone"]
+        if not zone_code or zone_code in rule_map:
+            continue
+        # Note : ici, row["rules"] est un dictionnaire, utilisez directement .get pour accéder aux champs internes
+        rules = row["rules"] if isinstance(row["rules"], dict) else {}
+        rule_map[zone_code] = {field: rules.get(field, "") for field in EMPTY_RULE}
+    index = ZoneIndex(rule_map)
+
+    # Appariement en lot : chaque LIBELLE distinct n'est recherché qu'une seule fois
+    import pandas as pd
+    labels = gdf["LIBELLE"] if "LIBELLE" in gdf.columns else pd.Series("", index=gdf.index)
+    labels = labels.fillna("").astype(str)
+    matches = index.match_many(labels)
+    keys = labels.map(lambda label: matches[label][0])
+    methods = labels.map(lambda label: matches[label][1])
+
+    gdf = gdf.copy()
+    for field in EMPTY_RULE:
+        gdf[field] = keys.map(lambda key: index.rules[key][field] if isinstance(key, str) and key else "")
+    gdf["match_method"] = methods
+    gdf.attrs["match_stats"] = match_statistics(insee_code, labels, methods)
     return gdf
+
+def match_statistics(insee_code: str, labels, methods) -> dict:
+    """
+    Statistiques d'appariement pour une commune : nombre de polygones par méthode
+    (exact, prefix, fuzzy, unmatched), taux d'appariement et libellés non appariés.
+    """
+    counts = methods.value_counts().to_dict()
+    total = int(len(methods))
+    unmatched = int(counts.get("unmatched", 0))
+    return {
+        "insee": insee_code,
+        "total": total,
+        "exact": int(counts.get("exact", 0)),
+        "prefix": int(counts.get("prefix", 0)),
+        "fuzzy": int(counts.get("fuzzy", 0)),
+        "unmatched": unmatched,
+        "match_rate": round((total - unmatched) / total, 4) if total else 0.0,
+        "unmatched_labels": sorted(set(labels[methods == "unmatched"])),
+    }
@@ -0,0 +1,113 @@
+import json
+import os
+import pathlib
+import sqlite3
+import sys
+
+RULES_DB = "rules.db"
+
+# Taille maximale de la projection mémoire (mmap) utilisée par SQLite en lecture
+MMAP_SIZE = 256 * 1024 * 1024
+
+RULE_FIELDS = ("max_height", "max_coverage", "setback_distance")
+
+SCHEMA = """
+CREATE TABLE rules (
+    id INTEGER PRIMARY KEY,
+    insee TEXT NOT NULL,
+    zone TEXT,
+    libzone TEXT,
+    max_height TEXT,
+    max_coverage TEXT,
+    setback_distance TEXT,
+    update_date TEXT,
+    source TEXT,
+    source_file TEXT
+);
+CREATE INDEX idx_rules_insee ON rules (insee);
+CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+def write_rules_db(results: dict, db_path: str = RULES_DB, metadata: dict = None):
+    """
+    Écrire les résultats d'extraction ({insee: [enregistrements]}, même forme que rules.json,
+    ou un itérable de paires (insee, enregistrements)) dans une base SQLite compacte indexée
+    par INSEE.
+    La base est construite dans un fichier temporaire puis remplacée de façon atomique.
+    """
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(SCHEMA)
+        rows = (
+            (
+                record.get("insee") or insee,
+                record.get("zone"),
+                record.get("libzone"),
+                *((record.get("rules") or {}).get(field, "") for field in RULE_FIELDS),
+                record.get("update_date"),
+                record.get("source"),
+                record.get("source_file"),
+            )
+            for insee, records in (results.items() if isinstance(results, dict) else results)
+            for record in records
+        )
+        conn.executemany(
+            "INSERT INTO rules (insee, zone, libzone, max_height, max_coverage,"
+            " setback_distance, update_date, source, source_file) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.executemany(
+            "INSERT INTO metadata (key, value) VALUES (?, ?)",
+            ((key, json.dumps(value)) for key, value in (metadata or {}).items()),
+        )
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
+
+def connect_readonly(db_path: str = RULES_DB) -> sqlite3.Connection:
+    """Ouvrir la base en lecture seule ; les pages sont lues via mmap et partagées par le cache du système."""
+    uri = pathlib.Path(db_path).resolve().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True)
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def fetch_insee(insee_code: str, db_path: str = RULES_DB) -> list:
+    """Retourner uniquement les enregistrements d'une commune, dans la même forme que rules.json."""
+    conn = connect_readonly(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT * FROM rules WHERE insee = ? ORDER BY id", (insee_code,)
+        ).fetchall()
+    finally:
+        conn.close()
+    return [
+        {
+            "zone": row["zone"],
+            "libzone": row["libzone"],
+            "insee": row["insee"],
+            "rules": {field: row[field] for field in RULE_FIELDS},
+            "update_date": row["update_date"],
+            "source": row["source"],
+            "source_file": row["source_file"],
+        }
+        for row in rows
+    ]
+
+def convert_json(json_path: str, db_path: str = RULES_DB):
+    """Convertir un rules.json existant en base SQLite."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    write_rules_db(data.get("results", {}), db_path, data.get("metadata"))
+
+if __name__ == "__main__":
+    # Utilisation : python rules_db.py [rules.json] [rules.db]
+    json_path = sys.argv[1] if len(sys.argv) > 1 else "rules.json"
+    db_path = sys.argv[2] if len(sys.argv) > 2 else RULES_DB
+    convert_json(json_path, db_path)
+    print(f"Base de règles écrite : {db_path}")
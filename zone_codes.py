@@ -0,0 +1,29 @@
+import re
+import unicodedata
+
+_ZONE_PREFIX_RE = re.compile(r"^(?:\(\s*Z\s*\)|ZONE\s+)")
+_ZONE_SEPARATORS_RE = re.compile(r"[\s\-_./]+")
+
+def normalize_zone_code(code) -> str:
+    """
+    Forme canonique d'un code de zone : majuscules, sans accents, sans espaces ni tirets,
+    sans préfixe "(Z)" ou "Zone". Par exemple "1 AU", "1-AU" et "1AU" donnent tous "1AU",
+    et "(Z)Ua" donne "UA".
+    """
+    if code is None or (isinstance(code, float) and code != code):
+        return ""
+    text = unicodedata.normalize("NFKD", str(code))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = text.strip().upper()
+    text = _ZONE_PREFIX_RE.sub("", text)
+    return _ZONE_SEPARATORS_RE.sub("", text)
+
+_ZONE_FAMILY_RE = re.compile(r"^\d*(AU|U|A|N)")
+
+def zone_family(code: str) -> str:
+    """
+    Famille d'un code canonique : "AU" (à urbaniser, y compris "1AU", "2AU"...), "U", "A" ou "N" ;
+    chaîne vide si le code ne relève d'aucune de ces familles.
+    """
+    match = _ZONE_FAMILY_RE.match(code)
+    return match.group(1) if match else ""